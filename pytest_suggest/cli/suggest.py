@@ -1,13 +1,15 @@
 import sys
 
 from pytest_suggest.constants import FILE_NAME
-from pytest_suggest.trie import Trie
+from pytest_suggest.trie import FlatTrie
 
 
 def main():
     with open(FILE_NAME, "rb") as f:
-        trie = Trie.load(f)
+        trie = FlatTrie.load(f)
 
     prefix = sys.argv[1] if len(sys.argv) > 1 else ""
-    for w in sorted(trie.words(prefix)):
-        print(w)
+    # words are already yielded in lexicographic order, and are written at once
+    out = "\n".join(trie.words_list(prefix))
+    if out:
+        sys.stdout.write(out + "\n")
@@ -1,9 +1,84 @@
-from pytest import Config, Item, Session, StashKey, hookimpl
+from __future__ import annotations
+
+import os
+import secrets
+import threading
+from collections.abc import Iterable
+
+from pytest import Config, ExitCode, Item, Session, StashKey, hookimpl
 
 from pytest_suggest.constants import FILE_NAME
-from pytest_suggest.trie import Trie
+from pytest_suggest.trie import Trie, read_digest, words_digest
+
+
+class IndexWriter(threading.Thread):
+    """Builds and saves the index of the collected tests in the background.
+
+    The index is written while pytest goes on reporting and tearing down the
+    session, and `finish` waits for it before the session ends. If the saved index
+    already contains the same tests, it is left untouched.
+    """
+
+    def __init__(self, ids: Iterable[str]) -> None:
+        super().__init__(name="pytest-suggest-index")
+        self.ids = set(ids)
+        self.size = len(self.ids)
+        # resolved here, on the main thread, so that a later change of the working
+        # directory can't move the index while it is written
+        self.path = os.path.abspath(FILE_NAME)
+        # False if the saved index was already up to date and was left untouched
+        self.saved = False
+        self.error: BaseException | None = None
+
+    def run(self) -> None:
+        try:
+            # sorted once, for both the digest and the build
+            words = sorted(self.ids)
+            digest = words_digest(words, sorted_input=True)
+            if _saved_digest(self.path) == digest:
+                return
+
+            _save(Trie.from_words(words, sorted_input=True), digest, self.path)
+            self.saved = True
+        except BaseException as e:
+            self.error = e
+
+    def finish(self) -> None:
+        """Waits for the index to be saved.
+
+        Raises:
+            BaseException: the error raised while building or saving the index.
+        """
+        self.join()
+        if self.error is not None:
+            raise self.error
+
 
-KEY = StashKey[Trie]()
+def _save(trie: Trie, digest: bytes, path: str) -> None:
+    # the index is written next to the old one and then moved over it: a failed
+    # write never leaves a truncated index behind a valid digest, and the readers
+    # that mapped the old index keep seeing it whole; the file is created with the
+    # mode given by the umask, like any other file
+    tmp = f"{path}.{secrets.token_hex(8)}.tmp"
+    f = open(tmp, "xb")
+    try:
+        with f:
+            trie.save(f, digest=digest)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _saved_digest(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return read_digest(f)
+    except OSError:
+        return None
+
+
+KEY = StashKey[IndexWriter]()
 
 
 def pytest_addoption(parser):
@@ -25,8 +100,8 @@ def pytest_report_header(config: Config):
 
 def pytest_report_collectionfinish(config: Config, startdir: str, items: list[Item]):
     if config.option.build_suggestion_index:
-        trie = config.stash[KEY]
-        return f"Built test index of size {len(trie)}"
+        writer = config.stash[KEY]
+        return f"Building test index of {writer.size} tests"
     return None
 
 
@@ -40,11 +115,34 @@ def pytest_collection_modifyitems(session: Session, config: Config, items: list[
     if not config.option.build_suggestion_index:
         return
 
-    trie = Trie.from_words(item.nodeid for item in items)
-    config.stash[KEY] = trie
-
-    with open(FILE_NAME, "wb") as f:
-        trie.save(f)
+    writer = IndexWriter(item.nodeid for item in items)
+    config.stash[KEY] = writer
+    writer.start()
 
     config.hook.pytest_deselected(items=items)
     items.clear()
+
+
+def pytest_sessionfinish(session: Session):
+    writer = session.config.stash.get(KEY, None)
+    if writer is None:
+        return
+
+    # this runs while the session is being torn down, so errors are reported here
+    # instead of being raised
+    try:
+        writer.finish()
+    except Exception as e:
+        _write_line(session, f"INTERNALERROR> Could not save the test index: {e!r}")
+        session.exitstatus = ExitCode.INTERNAL_ERROR
+    else:
+        if writer.saved:
+            _write_line(session, f"Saved test index of {writer.size} tests")
+        else:
+            _write_line(session, "Test index is up to date")
+
+
+def _write_line(session: Session, line: str) -> None:
+    reporter = session.config.pluginmanager.get_plugin("terminalreporter")
+    if reporter is not None:
+        reporter.write_line(line)
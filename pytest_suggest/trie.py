@@ -1,56 +1,250 @@
 from __future__ import annotations
 
-import pickle
-import weakref
-from collections.abc import Generator, Iterable
+import hashlib
+import io
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Generator, Iterable, Mapping, Sequence
+from types import MappingProxyType
 from typing import BinaryIO
 
 
-class Node:
-    """A node in a trie."""
+_MAGIC = b"PTSI"
+"""Magic bytes at the start of a saved trie."""
+_VERSION = 4
+"""Version of the format of a saved trie."""
+_HEADER = struct.Struct("<4sHIII16s")
+"""Header of a saved trie.
+
+It contains the magic bytes, the format version, the number of words, the number of
+nodes, the length in bytes of the text of the parts and the digest of the words.
+"""
+DIGEST_SIZE = 16
+"""Size in bytes of the digest of the words of a trie."""
+_ITEM_SIZE = struct.calcsize("<I")
+"""Size of an item of the offsets and ends arrays."""
+_MAX_INTERNED_LEN = 32
+"""Maximum length of the parts that are interned."""
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    """Computes the length of the longest common prefix of two strings.
+
+    The prefix is found by binary search over slice comparisons, so the characters
+    are compared by C code in O(log n) steps instead of one Python step each.
 
-    prefix: str
-    """The prefix represented up to this node.
-    
-    This is the concatenation of the prefixes from the root to this node.
+    Args:
+        a (str): the first string.
+        b (str): the second string.
+
+    Returns:
+        int: the length of the longest common prefix.
     """
-    part_len: int
-    """The length of the part represented by this node.
-    
-    This is the length of the part of the prefix that is represented by this node,
-    so for example if the prefix is "abc" and this node represents "ab", then this
-    value is 2.
+    lo, hi = 0, min(len(a), len(b))
+
+    # invariant: a[:lo] == b[:lo] and the common prefix is not longer than hi
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+def _intern(part: str) -> str:
+    """Interns a part of a word if it is short.
+
+    Short parts like "test_" or "]" repeat all over a trie of node ids, while long
+    ones are mostly the unique tails of single words, which would only fill the
+    table of interned strings.
+
+    Args:
+        part (str): the part.
+
+    Returns:
+        str: the interned part, or `part` itself if it is long.
     """
-    children: dict[str, Node]
-    """The children of this node.
+    return sys.intern(part) if len(part) <= _MAX_INTERNED_LEN else part
+
 
-    This is a mapping of the first character of the child to the child node.
+def words_digest(words: Iterable[str], *, sorted_input: bool = False) -> bytes:
+    """Computes a digest identifying a set of words.
+
+    The digest does not depend on the order of the words or on duplicates, so it
+    can be compared with the one stored in a saved trie to tell if the trie would
+    be the same without building it.
+
+    Args:
+        words (Iterable[str]): the words.
+        sorted_input (bool, optional): whether the words are already sorted and
+            without duplicates, in which case they are used as they are. Defaults to
+            False.
+
+    Returns:
+        bytes: the digest, `DIGEST_SIZE` bytes long.
     """
-    is_word: bool
-    """Whether this node represents a word in the trie or just a prefix."""
+    data = "\n".join(words if sorted_input else sorted(set(words))).encode()
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
 
-    parent: Node | None
-    """The parent of this node.
 
-    This is a weak reference to the parent node.
+def read_digest(from_: BinaryIO) -> bytes | None:
+    """Reads the digest of the words stored in the header of a saved trie.
 
-    The root node has no parent and this value is None.
+    Only the header is read.
+
+    Args:
+        from_ (BinaryIO): the stream to read from.
+
+    Returns:
+        bytes | None: the digest, or None if the stream does not contain a supported
+            trie index or the trie was saved without a digest.
+    """
+    header = from_.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+
+    magic, version, *_, digest = _HEADER.unpack(header)
+    if magic != _MAGIC or version != _VERSION or digest == bytes(DIGEST_SIZE):
+        return None
+    return digest
+
+
+def _map(from_: BinaryIO) -> memoryview:
+    """Maps the rest of the content of a stream in memory.
+
+    Plain files are memory-mapped from their current position, so that only the
+    pages that are actually accessed are read from the disk; other streams, like
+    compressed files or pipes, are read at once. Either way the stream is consumed
+    up to its end.
+
+    On Windows files are always read: a file with a live mapping cannot be replaced,
+    which would make the plugin fail to update the index while a completion is
+    reading it.
+
+    Args:
+        from_ (BinaryIO): the stream to read from.
+
+    Returns:
+        memoryview: the content of the stream from its current position.
+    """
+    if (
+        sys.platform == "win32"
+        or not isinstance(from_, (io.BufferedReader, io.FileIO))
+        or not from_.seekable()
+    ):
+        return memoryview(from_.read())
+
+    start = from_.tell()
+    end = from_.seek(0, io.SEEK_END)
+    # mmap cannot map an empty file
+    if start >= end:
+        return memoryview(b"")
+    return memoryview(mmap.mmap(from_.fileno(), 0, access=mmap.ACCESS_READ))[start:]
+
+
+def _read_index(
+    from_: BinaryIO,
+) -> tuple[int, Sequence[int], Sequence[int], Sequence[int], str]:
+    """Reads the arrays of a trie saved with `Trie.save`.
+
+    On little-endian machines the arrays are views over the mapped content, so no
+    copy of them is made.
+
+    Args:
+        from_ (BinaryIO): the stream to read from.
+
+    Raises:
+        ValueError: if the stream does not contain a supported trie index.
+
+    Returns:
+        tuple[int, Sequence[int], Sequence[int], Sequence[int], str]: the number of
+            words, the part offsets, the subtree ends, the word flags and the text of
+            the parts.
     """
+    data = _map(from_)
+    if len(data) < _HEADER.size:
+        raise ValueError("Not a trie index: file is truncated")
+
+    magic, version, size, n_nodes, text_len, _ = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not a trie index: bad magic bytes")
+    if version != _VERSION:
+        raise ValueError(f"Unsupported trie index version {version}")
+
+    # offsets has an extra trailing item, the end of the last part
+    offset = _HEADER.size
+    offsets_end = offset + (n_nodes + 1) * _ITEM_SIZE
+    ends_end = offsets_end + n_nodes * _ITEM_SIZE
+    flags_end = ends_end + n_nodes
+    if len(data) < flags_end + text_len:
+        raise ValueError("Not a trie index: file is truncated")
+
+    offsets: Sequence[int]
+    ends: Sequence[int]
+    if sys.byteorder == "little":
+        offsets = data[offset:offsets_end].cast("I")
+        ends = data[offsets_end:ends_end].cast("I")
+    else:
+        offsets = array("I", bytes(data[offset:offsets_end]))
+        ends = array("I", bytes(data[offsets_end:ends_end]))
+        offsets.byteswap()
+        ends.byteswap()
+
+    flags = data[ends_end:flags_end]
+    text = str(data[flags_end : flags_end + text_len], "utf-8")
+
+    return size, offsets, ends, flags, text
 
-    __slots__ = ("prefix", "part_len", "children", "is_word", "parent", "__weakref__")
+
+class Node:
+    """A node in a trie."""
+
+    part: str
+    """The part of the word represented by this node.
+
+    The word represented by a node is the concatenation of the parts from the root
+    to the node: it is not stored, and is rebuilt while walking down the trie, so
+    that each character is stored once instead of once per descendant.
+    """
+    keys: str
+    """The first characters of the children of this node.
+
+    The i-th character is the first character of the part of the i-th child in
+    `kids`. Looking up a child is a `str.find` on this string, which for the small
+    fan-outs of a trie is cheaper than hashing into a dict.
+    """
+    kids: list[Node] | tuple[()]
+    """The children of this node, in the same order as `keys`.
+
+    Leaves, about half of the nodes of a trie, share the empty tuple instead of
+    holding an empty list each; the list is created with the first child.
+    """
+    is_word: bool
+    """Whether this node represents a word in the trie or just a prefix."""
+
+    __slots__ = ("part", "keys", "kids", "is_word")
 
     def __init__(
         self,
-        prefix: str,
-        part_len: int,
+        part: str,
         children: dict[str, Node] | None = None,
         is_word: bool = False,
     ) -> None:
-        self.prefix = prefix
-        self.part_len = part_len
-        self.children = children or {}
+        # inlined _intern, as this is called for every node
+        self.part = sys.intern(part) if len(part) <= _MAX_INTERNED_LEN else part
+        if children:
+            self.keys = "".join(children)
+            self.kids = list(children.values())
+        else:
+            # the common case when building, so no throwaway mapping is created
+            self.keys = ""
+            self.kids = ()
         self.is_word = is_word
-        self.parent = None
 
     @staticmethod
     def root() -> Node:
@@ -59,36 +253,81 @@ class Node:
         Returns:
             Node: the root node.
         """
-        return Node(part_len=0, prefix="", is_word=False)
+        return Node("", is_word=False)
+
+    @property
+    def children(self) -> Mapping[str, Node]:
+        """The children of this node.
+
+        This is a read-only mapping of the first character of the child to the child
+        node.
+        """
+        return MappingProxyType(dict(zip(self.keys, self.kids)))
 
     def get_child(self, child: str) -> Node | None:
-        return self.children.get(child)
+        # keys is searched as a string, so only single characters are keys
+        if len(child) != 1:
+            return None
+        i = self.keys.find(child)
+        return self.kids[i] if i >= 0 else None
 
     def add_child(self, part: str, *, is_word: bool = False) -> Node:
-        node = Node(part_len=len(part), prefix=self.prefix + part, is_word=is_word)
-        self.children[part[0]] = node
-        node.parent = weakref.proxy(self)
+        node = Node(part, is_word=is_word)
+        self.keys += part[0]
+        if self.kids:
+            self.kids.append(node)
+        else:
+            self.kids = [node]
         return node
 
     def merge_with_child(self) -> None:
-        if self.is_word or len(self.children) != 1:
+        if self.is_word or len(self.kids) != 1:
             raise RuntimeError("Cannot merge a word node or with multiple children")
 
-        child = self.children.popitem()[1]
+        child = self.kids[0]
 
-        self.part_len += child.part_len
-        self.prefix = child.prefix
-        self.children = child.children
+        self.part = _intern(self.part + child.part)
+        self.keys = child.keys
+        self.kids = child.kids
         self.is_word = child.is_word
 
-        for grandchild in child.children.values():
-            grandchild.parent = self
+    def split(self, at: int) -> Node:
+        """Splits the part of this node in two.
+
+        This node keeps the first `at` characters of its part and gets a single new
+        child, which takes the rest of the part together with the children and the
+        word flag of this node.
+
+        Args:
+            at (int): the position where the part is split.
+
+        Raises:
+            ValueError: if the position is not strictly inside the part.
+
+        Returns:
+            Node: the new child.
+        """
+        if not 0 < at < len(self.part):
+            raise ValueError(f"Cannot split part {self.part!r} at {at}")
+
+        child = Node(self.part[at:], is_word=self.is_word)
+        child.keys = self.keys
+        child.kids = self.kids
+
+        self.part = _intern(self.part[:at])
+        self.keys = child.part[0]
+        self.kids = [child]
+        self.is_word = False
+
+        return child
 
     def __getitem__(self, child: str) -> Node:
-        return self.children[child]
+        if (node := self.get_child(child)) is not None:
+            return node
+        raise KeyError(child)
 
     def __str__(self) -> str:
-        return f"Node {self.prefix!r} -> {sorted(self.children)!r}"
+        return f"Node {self.part!r} -> {sorted(self.keys)!r}"
 
 
 class Trie:
@@ -104,103 +343,427 @@ class Trie:
         return self._size
 
     @staticmethod
-    def from_words(words: Iterable[str]) -> Trie:
+    def from_words(words: Iterable[str], *, sorted_input: bool = False) -> Trie:
+        """Builds a trie from some words.
+
+        Args:
+            words (Iterable[str]): the words, possibly with duplicates.
+            sorted_input (bool, optional): whether the words are already sorted, in
+                which case they are not sorted again. Defaults to False.
+
+        Raises:
+            ValueError: if `sorted_input` is set but the words are not sorted.
+
+        Returns:
+            Trie: the trie containing the words.
+        """
         trie = Trie()
 
-        for word in words:
-            cur = trie._root
-            for char in word:
-                if child := cur.get_child(char):
-                    cur = child
-                else:
-                    cur = cur.add_child(char)
-            cur.is_word = True
-            trie._size += 1
+        # words are inserted in lexicographic order, so each word shares with the
+        # trie exactly the longest common prefix with the previous word: the path
+        # of the previous word is kept (ends[i] is the length of the word up to the
+        # end of path[i]) and only the remaining suffix is added, as a single node
+        path = [trie._root]
+        ends = [0]
+        prev: str | None = None
+        size = 0
+
+        for word in words if sorted_input else sorted(words):
+            if word == prev:
+                continue
+            if prev is not None and word < prev:
+                raise ValueError(f"Words are not sorted: {word!r} follows {prev!r}")
+
+            lcp = 0 if prev is None else _common_prefix_len(prev, word)
 
-        trie._compress()
+            # drop the nodes of the previous word starting after the common prefix:
+            # ends is strictly increasing, so they are found with a bisection
+            keep = bisect_left(ends, lcp) + 1
+            del path[keep:], ends[keep:]
 
+            # the common prefix can end in the middle of the part of the last node
+            cur = path[-1]
+            if ends[-1] > lcp:
+                cur.split(len(cur.part) - (ends[-1] - lcp))
+                ends[-1] = lcp
+
+            if lcp < len(word):
+                cur = cur.add_child(word[lcp:])
+                path.append(cur)
+                ends.append(len(word))
+
+            cur.is_word = True
+            size += 1
+            prev = word
+
+        trie._size = size
         return trie
 
     @staticmethod
     def load(from_: BinaryIO) -> Trie:
-        return pickle.load(from_)
+        """Loads a trie saved with `save`.
+
+        Args:
+            from_ (BinaryIO): the stream to read from.
+
+        Returns:
+            Trie: the loaded trie.
+        """
+        size, offsets, ends, flags, text = _read_index(from_)
+
+        trie = Trie()
+        trie._size = size
+        root = trie._root
+        root.is_word = bool(flags[0])
+
+        # nodes are stored in preorder, so the parent of each node is the closest
+        # node on the stack whose subtree has not ended yet
+        parents = [root]
+        stops = [ends[0]]
+        for i in range(1, len(ends)):
+            while i >= stops[-1]:
+                parents.pop()
+                stops.pop()
+
+            part = text[offsets[i] : offsets[i + 1]]
+            node = parents[-1].add_child(part, is_word=bool(flags[i]))
+
+            parents.append(node)
+            stops.append(ends[i])
+
+        return trie
 
-    def save(self, to: BinaryIO) -> None:
-        pickle.dump(self, to)
+    def save(self, to: BinaryIO, *, digest: bytes = b"") -> None:
+        """Saves the trie as a flat arena of nodes.
+
+        The nodes are laid out in preorder as parallel arrays (part offsets, subtree
+        ends and word flags), followed by the concatenation of all the parts. The part
+        of node i is the text between offsets i and i + 1, and the end of a node is
+        the index following its last descendant, so the subtree of a node is a
+        contiguous range of the arrays.
+
+        Args:
+            to (BinaryIO): the stream to write to.
+            digest (bytes, optional): the digest of the words, as computed by
+                `words_digest`, stored in the header to be read back with
+                `read_digest`. Defaults to no digest.
+
+        Raises:
+            ValueError: if the digest is not `DIGEST_SIZE` bytes long.
+        """
+        if digest and len(digest) != DIGEST_SIZE:
+            raise ValueError(f"Digest must be {DIGEST_SIZE} bytes long")
+
+        parts: list[str] = []
+        offsets = array("I", [0])
+        ends = array("I")
+        flags = bytearray()
+        offset = 0
+
+        # a None node closes the subtree of node i: it is popped after all the
+        # descendants of i have been visited, so the end is known in a single pass
+        stack: list[tuple[Node | None, int]] = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if node is None:
+                ends[i] = len(parts)
+                continue
+
+            i = len(parts)
+            parts.append(node.part)
+            offset += len(node.part)
+            offsets.append(offset)
+            ends.append(i + 1)
+            flags.append(node.is_word)
+            if node.kids:
+                stack.append((None, i))
+                stack.extend((child, i) for child in reversed(node.kids))
+
+        text = "".join(parts).encode()
+
+        # arrays are always stored little-endian
+        if sys.byteorder == "big":
+            offsets.byteswap()
+            ends.byteswap()
+
+        header = _HEADER.pack(
+            _MAGIC, _VERSION, self._size, len(ends), len(text), digest
+        )
+        to.write(header)
+        to.write(offsets.tobytes())
+        to.write(ends.tobytes())
+        to.write(flags)
+        to.write(text)
 
     def __contains__(self, word: str) -> bool:
-        if node := self._find_node(word):
-            return node.is_word and node.prefix == word
+        found = self._find_node(word)
+        if found is None:
+            return False
 
-        return False
+        node, node_end = found
+        # the word must end exactly where the part of the node ends
+        return node.is_word and node_end == len(word)
 
     def words(self, prefix: str = "") -> Generator[str]:
-        stack: list[Node] = []
+        """Iterates over the words of the trie starting with a prefix.
+
+        Children are kept sorted by their first character, so the words are
+        yielded in lexicographic order.
+
+        Args:
+            prefix (str, optional): the prefix of the words. Defaults to "".
 
+        Yields:
+            str: the words starting with `prefix`.
+        """
         if prefix:
-            node = self._find_node(prefix)
-            if node is not None:
-                stack.append(node)
+            found = self._find_node(prefix)
+            if found is None:
+                return
+            node, node_end = found
+            word = prefix[: node_end - len(node.part)] + node.part
         else:
-            stack.append(self._root)
+            node, word = self._root, ""
 
-        while stack:
-            current = stack.pop()
+        yield from self._walk(node, word, sys.getrecursionlimit() // 2)
 
-            if current.is_word:
-                assert current.prefix is not None
-                yield current.prefix
+    def __str__(self) -> str:
+        buf = io.StringIO()
+        stack = [(self._root, "")]
 
-            for child in current.children.values():
-                stack.append(child)
+        while stack:
+            node, word = stack.pop()
+            stack.extend((child, word + child.part) for child in reversed(node.kids))
 
-    def __str__(self) -> str:
-        parts = []
-        self._to_str(self._root, parts, 1)
-        return "\n".join(parts)
+            # the root has no part to print
+            if not node.part:
+                continue
+
+            # the part is indented by the length of the word of the parent
+            depth = len(word) - len(node.part)
+            if node.is_word:
+                buf.write(" " * depth)
+                buf.write("✓├")
+                buf.write(node.part)
+                buf.write(" [")
+                buf.write(word)
+                buf.write("]\n")
+            else:
+                buf.write(" " * (depth + 1))
+                buf.write("├")
+                buf.write(node.part)
+                buf.write("\n")
+
+        # strip the trailing newline
+        return buf.getvalue()[:-1]
 
     def __iter__(self) -> Generator[str]:
         yield from self.words()
 
-    def _find_node(self, prefix: str) -> Node | None:
+    def _walk(self, node: Node, word: str, depth: int) -> Generator[str]:
+        # nested generators are cheaper than an explicit stack on the shallow tries
+        # of node ids; past the allowed depth the walk continues with a stack, so
+        # that deep tries don't hit the recursion limit
+        if not depth:
+            yield from self._walk_stack(node, word)
+            return
+
+        if node.is_word:
+            yield word
+
+        for child in node.kids:
+            yield from self._walk(child, word + child.part, depth - 1)
+
+    @staticmethod
+    def _walk_stack(node: Node, word: str) -> Generator[str]:
+        stack = [(node, word)]
+
+        while stack:
+            current, word = stack.pop()
+
+            if current.is_word:
+                yield word
+
+            # pushed in reverse, so that the smallest child is popped first
+            stack.extend((child, word + child.part) for child in reversed(current.kids))
+
+    def _find_node(self, prefix: str) -> tuple[Node, int] | None:
+        # returns the node where the prefix ends, together with the position where
+        # the part of that node ends, which is past the prefix if it ends inside it
         current = self._root
         cur = 0
+        end = len(prefix)
 
-        while cur < len(prefix):
-            char = prefix[cur]
-            child = current.get_child(char)
-            if child is None:
+        # this is the hot path of the suggestions, so the child lookup is inlined
+        while cur < end:
+            i = current.keys.find(prefix[cur])
+            if i < 0:
                 return None
-            cur += child.part_len
-            current = child
+            current = current.kids[i]
 
-        return current
+            # the first character only selects the child: the rest of the part is
+            # checked at once, keeping in mind that the prefix can end in its middle
+            part = current.part
+            if not prefix.startswith(part[: end - cur], cur):
+                return None
 
-    def _compress(self) -> None:
-        stack = [self._root]
+            cur += len(part)
 
-        while stack:
-            current = stack.pop()
-            children = list(current.children.values())
+        return current, cur
 
-            # don't compress if there are multiple children or if the current node is an end
-            if len(children) != 1 or current.is_word or current.part_len == 0:
-                stack.extend(children)
-                continue
 
-            current.merge_with_child()
-            stack.append(current)
+class FlatTrie:
+    """A read-only trie backed directly by the arrays of a saved index.
 
-    def _to_str(self, node: Node, parts: list[str], depth: int):
-        indent = " " * depth
-        if node.is_word:
-            indent = indent[:-1] + "✓"
-            trailer = f" [{node.prefix}]"
-        else:
-            trailer = ""
+    Loading it does not build any `Node`: lookups walk the preorder arrays written
+    by `Trie.save`, where the subtree of a node is the contiguous range of nodes up
+    to its end. This makes it suitable for one-shot queries, like the ones issued by
+    the shell completion on every keystroke.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        offsets: Sequence[int],
+        ends: Sequence[int],
+        flags: Sequence[int],
+        text: str,
+    ) -> None:
+        self._size = size
+        self._offsets = offsets
+        self._ends = ends
+        self._flags = flags
+        self._text = text
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def load(from_: BinaryIO) -> FlatTrie:
+        """Loads a trie saved with `Trie.save`.
+
+        Args:
+            from_ (BinaryIO): the stream to read from.
+
+        Returns:
+            FlatTrie: the loaded trie.
+        """
+        return FlatTrie(*_read_index(from_))
+
+    def words(self, prefix: str = "") -> Generator[str]:
+        """Iterates over the words of the trie starting with a prefix.
+
+        The words are yielded in lexicographic order.
+
+        Args:
+            prefix (str, optional): the prefix of the words. Defaults to "".
+
+        Yields:
+            str: the words starting with `prefix`.
+        """
+        found = self._find_node(prefix)
+        if found is None:
+            return
+
+        node, node_end = found
+        offsets, ends, flags, text = self._offsets, self._ends, self._flags, self._text
+        part = text[offsets[node] : offsets[node + 1]]
+        word = prefix[: node_end - len(part)] + part
+
+        if flags[node]:
+            yield word
+
+        # the stack holds the end and the word of the innermost open ancestors
+        stack = [(ends[node], word)]
+        for i in range(node + 1, ends[node]):
+            while i >= stack[-1][0]:
+                stack.pop()
+
+            word = stack[-1][1] + text[offsets[i] : offsets[i + 1]]
+            if flags[i]:
+                yield word
+            stack.append((ends[i], word))
+
+    def words_list(self, prefix: str = "") -> list[str]:
+        """Lists the words of the trie starting with a prefix.
+
+        This gives the same words as `words`, but collects them in a tight loop
+        instead of resuming a generator for each of them, which is faster when all
+        the words are needed anyway.
+
+        Args:
+            prefix (str, optional): the prefix of the words. Defaults to "".
+
+        Returns:
+            list[str]: the words starting with `prefix`, in lexicographic order.
+        """
+        found = self._find_node(prefix)
+        if found is None:
+            return []
+
+        node, node_end = found
+        offsets, ends, flags, text = self._offsets, self._ends, self._flags, self._text
+        part = text[offsets[node] : offsets[node + 1]]
+        word = prefix[: node_end - len(part)] + part
+
+        out = [word] if flags[node] else []
+        append = out.append
+
+        # same walk as in words, but the end and the word of the innermost open
+        # ancestor live in locals, and only the outer ones are on the stack
+        stop, parent = ends[node], word
+        stack: list[tuple[int, str]] = []
+        push, pop = stack.append, stack.pop
+        for i in range(node + 1, ends[node]):
+            while i >= stop:
+                stop, parent = pop()
+
+            word = parent + text[offsets[i] : offsets[i + 1]]
+            if flags[i]:
+                append(word)
+            push((stop, parent))
+            stop, parent = ends[i], word
+
+        return out
+
+    def __contains__(self, word: str) -> bool:
+        found = self._find_node(word)
+        if found is None:
+            return False
+
+        node, node_end = found
+        # the word must end exactly where the part of the node ends
+        return bool(self._flags[node]) and node_end == len(word)
+
+    def __iter__(self) -> Generator[str]:
+        yield from self.words()
+
+    def _find_node(self, prefix: str) -> tuple[int, int] | None:
+        # same contract as Trie._find_node, with the index of the node
+        offsets, ends, text = self._offsets, self._ends, self._text
+        node = 0
+        cur = 0
+        end = len(prefix)
+
+        while cur < end:
+            # children are consecutive subtrees, starting right after the node
+            char = prefix[cur]
+            child = node + 1
+            while child < ends[node] and text[offsets[child]] != char:
+                child = ends[child]
+            if child >= ends[node]:
+                return None
+
+            # the prefix can end in the middle of the part
+            part = text[offsets[child] : offsets[child + 1]]
+            if not prefix.startswith(part[: end - cur], cur):
+                return None
+
+            node = child
+            cur += len(part)
 
-        data = node.prefix[-node.part_len :]
-        if data:
-            parts.append(f"{indent}├{data}{trailer}")
-        for child in node.children.values():
-            self._to_str(child, parts, depth + node.part_len)
+        return node, cur
@@ -0,0 +1,39 @@
+import sys
+
+import pytest
+
+from pytest_suggest.cli.suggest import main
+from pytest_suggest.constants import FILE_NAME
+from pytest_suggest.trie import Trie
+
+IDS = [
+    "tests/b_test.py::test_b",
+    "tests/a_test.py::test_a[1]",
+    "tests/a_test.py::test_a[0]",
+    "tests/a_test.py::TestA::test_a",
+]
+
+
+@pytest.fixture(scope="session")
+def index_dir(tmp_path_factory):
+    # the index is only read by the tests, so it is built once
+    path = tmp_path_factory.mktemp("index")
+    with open(path / FILE_NAME, "wb") as f:
+        Trie.from_words(IDS).save(f)
+    return path
+
+
+@pytest.mark.parametrize(
+    ("prefix", "expected"),
+    [
+        ("tests/a_", sorted(IDS[1:])),
+        ("tests/b", IDS[:1]),
+        ("tests/c", []),
+    ],
+)
+def test_suggest(index_dir, monkeypatch, capsys, prefix, expected):
+    monkeypatch.chdir(index_dir)
+    monkeypatch.setattr(sys, "argv", ["pytest-suggest", prefix])
+    main()
+
+    assert capsys.readouterr().out == "".join(w + "\n" for w in expected)
@@ -0,0 +1,70 @@
+import random
+import string
+
+import pytest
+
+from pytest_suggest.trie import Trie
+
+pytest_plugins = ["pytester"]
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--runslow",
+        action="store_true",
+        default=False,
+        help="Run the tests marked as slow",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: slow test, run only with --runslow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+
+    skip_slow = pytest.mark.skip(reason="needs --runslow to run")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
+def _random_words(n: int, length: int) -> list[str]:
+    # all the characters are drawn at once from a seeded generator and sliced into
+    # words; with 31**length possible words collisions are negligible, so a 10%
+    # oversampling always leaves n unique words and no retry loop is needed
+    rng = random.Random(0)
+    chars = "".join(
+        rng.choices(string.ascii_lowercase + "/:_[]", k=(n + n // 10) * length)
+    )
+    words = list(
+        dict.fromkeys(chars[i : i + length] for i in range(0, len(chars), length))
+    )
+    assert len(words) >= n
+    return words[:n]
+
+
+# generates n unique random words of a given length, always the same ones
+@pytest.fixture(scope="session")
+def random_words():
+    return _random_words
+
+
+# a large corpus of random words and its trie, shared by the tests of the session:
+# the tests must not modify them
+@pytest.fixture(
+    scope="session",
+    params=[
+        pytest.param(1_000, id="small"),
+        pytest.param(10_000, marks=pytest.mark.slow, id="big"),
+    ],
+)
+def big_words(request):
+    return _random_words(request.param, 20)
+
+
+@pytest.fixture(scope="session")
+def big_trie(big_words):
+    return Trie.from_words(big_words)
@@ -0,0 +1,198 @@
+import os
+import shutil
+import stat
+import sys
+import textwrap
+
+import pytest
+
+from pytest_suggest.constants import FILE_NAME
+from pytest_suggest.plugin import IndexWriter
+from pytest_suggest.trie import FlatTrie, Trie
+
+IDS = [
+    "pkg/a_test.py::TestA::test_a",
+    "pkg/a_test.py::test_b",
+    "pkg/b_test.py::test_c[0]",
+    "pkg/b_test.py::test_c[1]",
+]
+
+
+@pytest.fixture(scope="session")
+def tests_tree(tmp_path_factory):
+    # the tree is the same for every test, so it is written once and copied
+    root = tmp_path_factory.mktemp("tests_tree")
+    pkg = root / "pkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").touch()
+    (pkg / "a_test.py").write_text(
+        textwrap.dedent(
+            """
+            class TestA:
+                def test_a(self):
+                    pass
+
+            def test_b():
+                pass
+            """
+        )
+    )
+    (pkg / "b_test.py").write_text(
+        textwrap.dedent(
+            """
+            import pytest
+
+            @pytest.mark.parametrize("x", [0, 1])
+            def test_c(x):
+                pass
+            """
+        )
+    )
+    (root / "tox.ini").write_text("[pytest]\npython_files = *_test.py\n")
+    return root
+
+
+@pytest.fixture
+def setup_tests(pytester, tests_tree):
+    shutil.copytree(tests_tree, pytester.path, dirs_exist_ok=True)
+
+
+def test_build_index(pytester, setup_tests):
+    result = pytester.runpytest("--build-suggestion-index")
+
+    result.stdout.fnmatch_lines(
+        ["Building test index of 4 tests", "Saved test index of 4 tests"]
+    )
+    result.assert_outcomes(deselected=4)
+    with open(pytester.path / FILE_NAME, "rb") as f:
+        assert list(Trie.load(f)) == IDS
+
+
+def test_build_index_unchanged(pytester, setup_tests):
+    pytester.runpytest("--build-suggestion-index")
+    index = pytester.path / FILE_NAME
+    index.write_bytes(index.read_bytes() + b"marker")
+
+    result = pytester.runpytest("--build-suggestion-index")
+
+    result.assert_outcomes(deselected=4)
+    result.stdout.fnmatch_lines(["Test index is up to date"])
+    # the same tests were collected, so the index was not written again
+    assert index.read_bytes().endswith(b"marker")
+
+
+def test_build_index_changed(pytester, setup_tests):
+    pytester.runpytest("--build-suggestion-index")
+    pytester.makepyfile(**{"pkg/c_test": "def test_d():\n    pass\n"})
+
+    result = pytester.runpytest("--build-suggestion-index")
+
+    result.stdout.fnmatch_lines(["Saved test index of 5 tests"])
+    with open(pytester.path / FILE_NAME, "rb") as f:
+        assert list(Trie.load(f)) == [*IDS, "pkg/c_test.py::test_d"]
+
+
+def test_build_index_error(pytester, setup_tests):
+    (pytester.path / FILE_NAME).mkdir()
+
+    result = pytester.runpytest("--build-suggestion-index")
+
+    assert result.ret == pytest.ExitCode.INTERNAL_ERROR
+    result.stdout.no_fnmatch_line("Saved test index*")
+    result.stdout.fnmatch_lines(["*Could not save the test index: *Error*"])
+
+
+def test_run_without_build(pytester, setup_tests):
+    result = pytester.runpytest()
+
+    result.assert_outcomes(passed=4)
+    assert not (pytester.path / FILE_NAME).exists()
+
+
+def test_run_without_plugin(pytester, setup_tests):
+    result = pytester.runpytest("-p", "no:suggest", "--build-suggestion-index")
+
+    result.stderr.fnmatch_lines(["*unrecognized arguments: --build-suggestion-index*"])
+    assert not (pytester.path / FILE_NAME).exists()
+
+
+def test_index_writer_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # words can't be sorted, so building the index fails in the thread
+    writer = IndexWriter(["a", None])
+    writer.start()
+
+    with pytest.raises(TypeError):
+        writer.finish()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX file modes")
+def test_index_writer_mode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    umask = os.umask(0o022)
+    try:
+        writer = IndexWriter(["a"])
+        writer.start()
+        writer.finish()
+    finally:
+        os.umask(umask)
+
+    assert stat.S_IMODE((tmp_path / FILE_NAME).stat().st_mode) == 0o644
+
+
+def test_index_writer_chdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = IndexWriter(["a"])
+    (tmp_path / "other").mkdir()
+    monkeypatch.chdir(tmp_path / "other")
+
+    writer.start()
+    writer.finish()
+
+    # the index goes where the working directory was when the tests were collected
+    assert not (tmp_path / "other" / FILE_NAME).exists()
+    with open(tmp_path / FILE_NAME, "rb") as f:
+        assert list(Trie.load(f)) == ["a"]
+
+
+def test_index_writer_partial_write(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = IndexWriter(["a"])
+    writer.start()
+    writer.finish()
+
+    def save(self, to, *, digest):
+        to.write(b"PTSI")
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(Trie, "save", save)
+    writer = IndexWriter(["b"])
+    writer.start()
+    with pytest.raises(OSError, match="No space"):
+        writer.finish()
+
+    # the old index is still whole, and nothing else is left behind
+    assert [p.name for p in tmp_path.iterdir()] == [FILE_NAME]
+    with open(FILE_NAME, "rb") as f:
+        assert list(Trie.load(f)) == ["a"]
+
+
+def test_index_writer_mapped_reader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = IndexWriter(["a", "b"])
+    writer.start()
+    writer.finish()
+
+    with open(FILE_NAME, "rb") as f:
+        trie = FlatTrie.load(f)
+
+    writer = IndexWriter(["c"])
+    writer.start()
+    writer.finish()
+
+    # the index is replaced rather than rewritten in place, so a completion that
+    # mapped it during a rebuild still sees the old one whole (on Windows, where a
+    # mapped file cannot be replaced, the index is read instead of mapped)
+    assert list(trie) == ["a", "b"]
+    with open(FILE_NAME, "rb") as f:
+        assert list(FlatTrie.load(f)) == ["c"]
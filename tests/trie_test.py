@@ -1,38 +1,71 @@
+import gzip
+import io
+import mmap
+import struct
+import sys
+import time
+from collections import Counter
+
 import pytest
 
-from pytest_suggest.trie import Node, Trie
+from pytest_suggest.trie import (
+    DIGEST_SIZE,
+    FlatTrie,
+    Node,
+    Trie,
+    _common_prefix_len,
+    read_digest,
+    words_digest,
+)
+
+
+@pytest.mark.parametrize(
+    ("a", "b", "expected"),
+    [
+        ("", "", 0),
+        ("abc", "", 0),
+        ("abc", "abc", 3),
+        ("abc", "abd", 2),
+        ("abc", "abcdef", 3),
+        ("xbc", "abc", 0),
+        ("tests/a.py::test_a", "tests/a.py::test_b", 17),
+    ],
+)
+def test_common_prefix_len(a, b, expected):
+    assert _common_prefix_len(a, b) == expected
+    assert _common_prefix_len(b, a) == expected
 
 
 class TestNode:
     def test_init(self):
-        node = Node("prefix", 3, is_word=True)
+        node = Node("prefix", is_word=True)
 
-        assert node.prefix == "prefix"
-        assert node.part_len == 3
+        assert node.part == "prefix"
         assert node.is_word is True
         assert node.children == {}
 
     def test_root(self):
         node = Node.root()
 
-        assert node.parent is None
-        assert node.part_len == 0
+        assert node.part == ""
         assert node.children == {}
         assert node.is_word is False
-        assert node.prefix == ""
 
     def test_child(self):
         parent = Node.root()
 
         a = parent.add_child("abc")
-        assert a.parent == parent
-
         b = parent.add_child("bcd")
-        assert b.parent == parent
 
         assert parent.get_child("a") is a
         assert parent.get_child("b") is b
         assert parent.get_child("c") is None
+        assert parent.kids == [a, b]
+        assert a.kids == ()
+
+        for k in ("", "ab", "abc"):
+            assert parent.get_child(k) is None
+        assert a.get_child("") is None
 
         assert parent["a"] is a
         assert parent["b"] is b
@@ -51,11 +84,13 @@ class TestNode:
         parent.merge_with_child()
 
         assert parent.is_word == child_is_word
-        assert parent.prefix == "a/"
-        assert parent.part_len == 2
-        assert parent.children == a.children
-        assert b.parent is parent
-        assert c.parent is parent
+        assert parent.part == "a/"
+        assert parent.keys == "bc"
+        assert parent.kids == [b, c]
+        assert parent.children == {"b": b, "c": c}
+
+        with pytest.raises(TypeError):
+            parent.children["d"] = c
 
     def test_merge_multiple_children(self):
         parent = Node.root()
@@ -74,30 +109,147 @@ class TestNode:
         with pytest.raises(RuntimeError):
             c1.merge_with_child()
 
+    @pytest.mark.parametrize("is_word", [True, False])
+    def test_split(self, is_word):
+        node = Node("abcd", is_word=is_word)
+        grandchild = node.add_child("e$", is_word=True)
+
+        child = node.split(1)
+
+        assert node.part == "a"
+        assert node.is_word is False
+        assert node.keys == "b"
+        assert node.kids == [child]
+        assert child.part == "bcd"
+        assert child.is_word is is_word
+        assert child.keys == "e"
+        assert child.kids == [grandchild]
+
+    @pytest.mark.parametrize("at", [0, 4, 5, -1])
+    def test_split_outside_part(self, at):
+        node = Node("abcd")
+
+        with pytest.raises(ValueError):
+            node.split(at)
+
+    def test_intern(self):
+        short = "".join(["test_", "a"])
+        long = "".join(["test_", "a" * 40])
+
+        assert Node(short).part is sys.intern("test_a")
+        assert Node(long).part is long
+
+    def test_identity(self):
+        a = Node("abc", is_word=True)
+        b = Node("abc", is_word=True)
+
+        assert a == a
+        assert a != b
+        assert len({a, b, a}) == 2
+
     def test_str(self):
-        node = Node.root()
-        c1 = node.add_child("abc")
-        gc1 = c1.add_child("def")
-        c2 = node.add_child("bcd")
+        # a fixed shape, so it is built directly instead of with add_child
+        gc1 = Node("def")
+        c1 = Node("abc", {"d": gc1})
+        c2 = Node("bcd")
+        node = Node("", {"a": c1, "b": c2})
 
         assert str(node) == "Node '' -> ['a', 'b']"
         assert str(c1) == "Node 'abc' -> ['d']"
         assert str(c2) == "Node 'bcd' -> []"
-        assert str(gc1) == "Node 'abcdef' -> []"
+        assert str(gc1) == "Node 'def' -> []"
 
 
 WORDS = ["casa", "casale", "casino", "casotto", "casinino", "pippo", "pluto"]
 
 
+# the trie built from WORDS, never modified by the tests; children are listed in
+# order, as they are kept sorted in the trie
+EXPECTED_ROOT = Node(
+    "",
+    {
+        "c": Node(
+            "cas",
+            {
+                "a": Node(
+                    "a",
+                    {"l": Node("le", is_word=True)},
+                    is_word=True,
+                ),
+                "i": Node(
+                    "in",
+                    {
+                        "i": Node("ino", is_word=True),
+                        "o": Node("o", is_word=True),
+                    },
+                ),
+                "o": Node("otto", is_word=True),
+            },
+        ),
+        "p": Node(
+            "p",
+            {
+                "i": Node("ippo", is_word=True),
+                "l": Node("luto", is_word=True),
+            },
+        ),
+    },
+)
+
+
+# each word is in the trie, while its extensions and truncations are not
+CONTAINS_CASES = tuple(
+    t
+    for w in WORDS
+    for t in [(w, True), (w + "0", False), (w[:-1], False), (w[1:], False)]
+) + (("foo", False), ("bar", False), ("baz", False))
+
+
+# the words yielded for each prefix, in any order
+PREFIX_CASES = (
+    ("cas", ["casa", "casale", "casino", "casotto", "casinino"]),
+    ("casa", ["casa", "casale"]),
+    ("case", []),
+    ("casi", ["casino", "casinino"]),
+    ("p", ["pippo", "pluto"]),
+    ("pl", ["pluto"]),
+    ("ca", ["casa", "casale", "casino", "casotto", "casinino"]),
+    ("cx", []),
+    ("casix", []),
+    ("pippoo", []),
+    ("", WORDS),
+)
+WORDS_COUNT = Counter(WORDS)
+SORTED_WORDS = sorted(WORDS)
+
+
+# lookups don't modify the trie, so it is built once for all the tests using it
+@pytest.fixture(scope="module")
+def shared_trie():
+    return Trie.from_words(WORDS)
+
+
+@pytest.fixture(scope="module")
+def duplicates_trie():
+    return Trie.from_words(WORDS * 2)
+
+
 class TestTrie:
     def test_build(self):
         trie = Trie.from_words(WORDS)
-        root = self._build_trie_manually()
-        self._check_node_eq(trie._root, root)
+        self._check_node_eq(trie._root, EXPECTED_ROOT)
+
+    def test_build_sorted_input(self):
+        trie = Trie.from_words(iter(SORTED_WORDS), sorted_input=True)
+        self._check_node_eq(trie._root, EXPECTED_ROOT)
+
+    def test_build_sorted_input_unsorted(self):
+        with pytest.raises(ValueError, match="not sorted"):
+            Trie.from_words(WORDS, sorted_input=True)
 
     def test_save_load(self, tmp_path):
         trie = Trie.from_words(WORDS)
-        path = tmp_path / "trie.pkl"
+        path = tmp_path / "trie.idx"
 
         with path.open("wb") as f:
             trie.save(f)
@@ -105,116 +257,310 @@ class TestTrie:
         with path.open("rb") as f:
             trie2 = Trie.load(f)
 
+        assert len(trie2) == len(trie)
         self._check_node_eq(trie._root, trie2._root)
 
-    def _build_trie_manually(self):
-        return Node(
-            "",
-            0,
-            {
-                "c": Node(
-                    "cas",
-                    3,
-                    {
-                        "a": Node(
-                            "casa",
-                            1,
-                            {"l": Node("casale", 2, is_word=True)},
-                            is_word=True,
-                        ),
-                        "i": Node(
-                            "casin",
-                            2,
-                            {
-                                "o": Node("casino", 1, is_word=True),
-                                "i": Node("casinino", 3, is_word=True),
-                            },
-                        ),
-                        "o": Node("casotto", 4, is_word=True),
-                    },
-                ),
-                "p": Node(
-                    "p",
-                    1,
-                    {
-                        "i": Node("pippo", 4, is_word=True),
-                        "l": Node("pluto", 4, is_word=True),
-                    },
-                ),
-            },
+    def test_save_load_big(self, big_words, big_trie):
+        words, trie = big_words, big_trie
+
+        # loading from a file is covered by the smaller tests
+        buf = io.BytesIO()
+        trie.save(buf)
+        buf.seek(0)
+        trie2 = Trie.load(buf)
+
+        assert len(trie2) == len(words)
+        assert list(trie2) == sorted(words)
+        # saving is deterministic, so the same structure gives the same bytes
+        buf2 = io.BytesIO()
+        trie2.save(buf2)
+        assert buf2.getvalue() == buf.getvalue()
+
+        # the same arena can also be queried in place
+        buf.seek(0)
+        flat = FlatTrie.load(buf)
+
+        assert len(flat) == len(words)
+        assert flat.words_list() == sorted(words)
+        assert all(word in flat for word in words[:100])
+
+    @pytest.mark.slow
+    def test_build_scales_linearly(self, random_words):
+        def build_time(words):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                Trie.from_words(words)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        small = build_time(random_words(5_000, 20))
+        big = build_time(random_words(40_000, 20))
+
+        # 8 times the words take about 9-11 times as long, because of the sort; the
+        # bound leaves over twice that for the noise of parallel runs (-n auto),
+        # while a quadratic step in the build would take about 64 times as long
+        assert big < 24 * small
+
+    @pytest.mark.parametrize(
+        ("data", "message"),
+        [
+            (b"PT", "truncated"),
+            (b"NOPE" + bytes(30), "bad magic"),
+            (b"PTSI\x09\x00" + bytes(28), "version 9"),
+        ],
+    )
+    def test_load_invalid(self, data, message):
+        with pytest.raises(ValueError, match=message):
+            Trie.load(io.BytesIO(data))
+
+    def test_save_format(self, shared_trie):
+        # the nodes in preorder, with the index following their last descendant
+        nodes = [
+            ("", 11, False),
+            ("cas", 8, False),
+            ("a", 4, True),
+            ("le", 4, True),
+            ("in", 7, False),
+            ("ino", 6, True),
+            ("o", 7, True),
+            ("otto", 8, True),
+            ("p", 11, False),
+            ("ippo", 10, True),
+            ("luto", 11, True),
+        ]
+        offsets = [0]
+        for part, _, _ in nodes:
+            offsets.append(offsets[-1] + len(part))
+        text = "".join(part for part, _, _ in nodes).encode()
+        expected = b"".join(
+            [
+                b"PTSI",
+                struct.pack("<HIII", 4, len(WORDS), len(nodes), len(text)),
+                bytes(DIGEST_SIZE),
+                struct.pack(f"<{len(offsets)}I", *offsets),
+                struct.pack(f"<{len(nodes)}I", *(end for _, end, _ in nodes)),
+                bytes(is_word for _, _, is_word in nodes),
+                text,
+            ]
         )
 
-    def _check_node_eq(self, node1: Node, node2: Node):
-        assert node1.prefix == node2.prefix
-        assert node1.part_len == node2.part_len
-        assert node1.is_word == node2.is_word
-        assert node1.children.keys() == node2.children.keys()
+        buf = io.BytesIO()
+        shared_trie.save(buf)
+        assert buf.getvalue() == expected
+
+    def test_save_digest(self):
+        digest = words_digest(WORDS)
+        buf = io.BytesIO()
+        Trie.from_words(WORDS).save(buf, digest=digest)
+
+        buf.seek(0)
+        assert read_digest(buf) == digest
+        buf.seek(0)
+        assert list(Trie.load(buf)) == SORTED_WORDS
+
+    @pytest.mark.parametrize("digest", [b"short", bytes(DIGEST_SIZE + 1)])
+    def test_save_digest_invalid(self, digest):
+        with pytest.raises(ValueError, match="Digest"):
+            Trie.from_words(WORDS).save(io.BytesIO(), digest=digest)
+
+    def test_read_digest_missing(self):
+        buf = io.BytesIO()
+        Trie.from_words(WORDS).save(buf)
+
+        buf.seek(0)
+        assert read_digest(buf) is None
+        assert read_digest(io.BytesIO(b"NOPE" + bytes(30))) is None
+        assert read_digest(io.BytesIO(b"PT")) is None
+
+    def test_words_digest(self):
+        digest = words_digest(WORDS)
+
+        assert len(digest) == DIGEST_SIZE
+        assert words_digest(reversed(WORDS)) == digest
+        assert words_digest(WORDS * 2) == digest
+        assert words_digest(SORTED_WORDS, sorted_input=True) == digest
+        assert words_digest(WORDS[1:]) != digest
+        # the separator of the words is part of the digest
+        assert words_digest(["ab", "c"]) != words_digest(["a", "bc"])
 
-        for k, v in node1.children.items():
-            self._check_node_eq(v, node2.children[k])
+    def _check_node_eq(self, node1: Node, node2: Node):
+        stack = [(node1, node2)]
+        while stack:
+            a, b = stack.pop()
+            assert (a.part, a.is_word, a.keys) == (b.part, b.is_word, b.keys)
+            stack.extend(zip(a.kids, b.kids))
 
     @pytest.mark.parametrize(
-        ("word", "expected"),
-        [
-            t
-            for w in WORDS
-            for t in [(w, True), (w + "0", False), (w[:-1], False), (w[1:], False)]
-        ]
-        + [
-            ("foo", False),
-            ("bar", False),
-            ("baz", False),
-        ],
+        ("word", "expected"), CONTAINS_CASES, ids=[w for w, _ in CONTAINS_CASES]
     )
-    def test_contains(self, word, expected):
-        trie = Trie.from_words(WORDS)
-        assert (word in trie) == expected
+    def test_contains(self, shared_trie, word, expected):
+        assert (word in shared_trie) == expected
+
+    def test_words(self, shared_trie):
+        words = list(shared_trie.words())
+        # iterating the trie is the same as iterating its words
+        assert list(shared_trie) == words
+        assert Counter(words) == WORDS_COUNT
+
+    def test_words_sorted(self, shared_trie):
+        assert list(shared_trie.words()) == SORTED_WORDS
+        assert list(shared_trie.words("cas")) == sorted(
+            w for w in WORDS if w.startswith("cas")
+        )
 
-    def test_words(self):
-        trie = Trie.from_words(WORDS)
-        assert set(trie.words()) == set(WORDS)
-        assert set(trie) == set(WORDS)
+    def test_words_deep(self):
+        # every node is a word, so nothing is compressed and the trie is as deep
+        # as its longest word
+        words = ["a" * i for i in range(1, 3 * sys.getrecursionlimit())]
+        trie = Trie.from_words(words)
+        assert list(trie.words()) == words
+        assert list(trie.words("a" * 10)) == words[9:]
 
     @pytest.mark.parametrize(
         ("prefix", "expected"),
-        [
-            ("cas", ["casa", "casale", "casino", "casotto", "casinino"]),
-            ("casa", ["casa", "casale"]),
-            ("case", []),
-            ("casi", ["casino", "casinino"]),
-            ("p", ["pippo", "pluto"]),
-            ("pl", ["pluto"]),
-            ("", WORDS),
-        ],
+        [(prefix, Counter(expected)) for prefix, expected in PREFIX_CASES],
+        ids=[repr(prefix) for prefix, _ in PREFIX_CASES],
     )
-    def test_words_prefixes(self, prefix, expected):
-        trie = Trie.from_words(WORDS)
-        assert set(trie.words(prefix)) == set(expected)
-
-    def test_str(self):
-        trie = Trie.from_words(sorted(WORDS))
-        s = """
- ├cas
-   ✓├a [casa]
-    ✓├le [casale]
-    ├in
-     ✓├ino [casinino]
-     ✓├o [casino]
-   ✓├otto [casotto]
- ├p
- ✓├ippo [pippo]
- ✓├luto [pluto]"""
-        s = s[1:]  # strip leading newline
-        assert str(trie) == s
-
-    def test_duplicate_words(self):
-        words_with_duplicates = WORDS + WORDS
-        trie = Trie.from_words(words_with_duplicates)
+    def test_words_prefixes(self, shared_trie, prefix, expected):
+        assert Counter(shared_trie.words(prefix)) == expected
+
+    def test_str(self, shared_trie):
+        lines = [
+            " ├cas",
+            "   ✓├a [casa]",
+            "    ✓├le [casale]",
+            "    ├in",
+            "     ✓├ino [casinino]",
+            "     ✓├o [casino]",
+            "   ✓├otto [casotto]",
+            " ├p",
+            " ✓├ippo [pippo]",
+            " ✓├luto [pluto]",
+        ]
+        assert str(shared_trie) == "\n".join(lines)
 
+    def test_duplicate_words(self, duplicates_trie):
         # Ensure duplicates don't affect the trie structure
-        assert set(trie.words()) == set(WORDS)
-        assert set(trie) == set(WORDS)
+        assert len(duplicates_trie) == len(WORDS)
+        words = list(duplicates_trie.words())
+        assert list(duplicates_trie) == words
+        assert Counter(words) == WORDS_COUNT
 
         # Ensure the duplicate words are still recognized as valid words
         for word in ["casa", "casino", "pippo"]:
-            assert word in trie
+            assert word in duplicates_trie
+
+        # Ensure many copies of each word collapse too
+        assert len(Trie.from_words(WORDS * 1_000)) == len(WORDS)
+
+
+class TestFlatTrie:
+    @pytest.fixture(scope="class")
+    def trie(self):
+        buf = io.BytesIO()
+        Trie.from_words(WORDS).save(buf)
+        buf.seek(0)
+        return FlatTrie.load(buf)
+
+    def test_load_file(self, tmp_path):
+        path = tmp_path / "trie.idx"
+        with path.open("wb") as f:
+            Trie.from_words(WORDS).save(f)
+
+        with path.open("rb") as f:
+            trie = FlatTrie.load(f)
+
+        assert list(trie) == SORTED_WORDS
+
+    def test_load_file_windows(self, tmp_path, monkeypatch):
+        path = tmp_path / "trie.idx"
+        with path.open("wb") as f:
+            Trie.from_words(WORDS).save(f)
+
+        # files are read instead of mapped, so the plugin can still replace them
+        monkeypatch.setattr(sys, "platform", "win32")
+        with path.open("rb") as f:
+            trie = FlatTrie.load(f)
+            assert f.read() == b""
+
+        assert not isinstance(trie._flags.obj, mmap.mmap)
+        assert list(trie) == SORTED_WORDS
+
+    def test_load_file_position(self, tmp_path):
+        path = tmp_path / "trie.idx"
+        with path.open("wb") as f:
+            f.write(b"junk")
+            Trie.from_words(WORDS).save(f)
+
+        with path.open("rb") as f:
+            f.read(4)
+            trie = FlatTrie.load(f)
+
+        assert list(trie) == SORTED_WORDS
+
+    def test_load_gzip(self, tmp_path):
+        path = tmp_path / "trie.idx.gz"
+        with gzip.open(path, "wb") as f:
+            Trie.from_words(WORDS).save(f)
+
+        with gzip.open(path, "rb") as f:
+            assert list(FlatTrie.load(f)) == SORTED_WORDS
+        with gzip.open(path, "rb") as f:
+            assert list(Trie.load(f)) == SORTED_WORDS
+
+    @pytest.mark.parametrize("size", [0, 10, 40])
+    def test_load_file_truncated(self, tmp_path, size):
+        buf = io.BytesIO()
+        Trie.from_words(WORDS).save(buf)
+        path = tmp_path / "trie.idx"
+        path.write_bytes(buf.getvalue()[:size])
+
+        with path.open("rb") as f, pytest.raises(ValueError, match="truncated"):
+            FlatTrie.load(f)
+
+    def test_words(self, trie):
+        assert len(trie) == len(WORDS)
+        assert list(trie.words()) == SORTED_WORDS
+        assert list(trie) == SORTED_WORDS
+
+    # words are yielded in order, so the expected lists are sorted up front
+    @pytest.mark.parametrize(
+        ("prefix", "expected"),
+        [
+            (prefix, sorted(expected))
+            for prefix, expected in [
+                ("ca", ["casa", "casale", "casino", "casotto", "casinino"]),
+                ("casa", ["casa", "casale"]),
+                ("casal", ["casale"]),
+                ("casi", ["casino", "casinino"]),
+                ("casinin", ["casinino"]),
+                ("case", []),
+                ("cx", []),
+                ("pippo", ["pippo"]),
+                ("pippoo", []),
+                ("", WORDS),
+            ]
+        ],
+    )
+    def test_words_prefixes(self, trie, prefix, expected):
+        assert list(trie.words(prefix)) == expected
+        assert trie.words_list(prefix) == expected
+
+    @pytest.mark.parametrize(
+        ("word", "expected"),
+        [
+            ("casa", True),
+            ("casale", True),
+            ("casinino", True),
+            ("pluto", True),
+            ("", False),
+            ("cas", False),
+            ("casal", False),
+            ("casx", False),
+            ("plutone", False),
+            ("foo", False),
+        ],
+    )
+    def test_contains(self, trie, word, expected):
+        assert (word in trie) == expected